@@ -1,42 +1,273 @@
 """
 Push depth to Water Linked Underwater GPS
+
+Either send a fixed depth/temperature (optionally repeated), or stream depth from a live
+source (stdin, UDP or serial). Streamed input is one reading per line: "depth" or "depth,temp".
 """
 import requests
 import argparse
+import socket
+import sys
+import threading
 import time
 import logging
+import ugps_profile
 
 log = logging.getLogger()
 logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
 
 
-def set_depth(url, depth, temp):
+class SetupException(Exception):
+    pass
+
+
+class StdinReader(object):
+    def iter(self):
+        for line in sys.stdin:
+            yield line
+
+
+class SerialReader(object):
+    def __init__(self, port, baud):
+        import serial
+        try:
+            self.ser = serial.Serial(port, baud, timeout=5.0)
+        except serial.SerialException as err:
+            print("Serial connection error: {}".format(err))
+            raise SetupException()
+
+    def iter(self):
+        while True:
+            line = self.ser.readline()
+            if line:
+                yield line
+
+
+class UDPReader(object):
+    def __init__(self, host, port):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.sock.bind((host, port))
+        except socket.error as err:
+            print("UDP setup: Could not bind to {}:{}. Error: {}".format(host, port, err))
+            raise SetupException()
+
+    def iter(self):
+        while True:
+            data, addr = self.sock.recvfrom(1024)
+            # A datagram may carry several readings, only complete lines are used
+            for line in data.splitlines():
+                yield line
+
+
+class LatestValue(object):
+    """
+    Hold the most recent depth reading. A reading that is replaced before it has been
+    sent is counted as coalesced, so the sender always pushes the freshest value.
+    """
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.value = None
+        self.received = None
+        self.coalesced = 0
+        self.closed = False
+
+    def put(self, value):
+        with self.cond:
+            if self.value is not None:
+                self.coalesced += 1
+            self.value = value
+            self.received = time.monotonic()
+            self.cond.notify()
+
+    def close(self):
+        """Mark the source as ended, waking up a waiting sender"""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def take(self, timeout):
+        """
+        Wait up to timeout seconds for a reading and return (value, time received).
+        Returns (None, None) on timeout or when the source has ended.
+        """
+        with self.cond:
+            if self.value is None and not self.closed:
+                self.cond.wait(timeout)
+            value, received = self.value, self.received
+            self.value = None
+            return value, received
+
+
+def parse_line(line, default_temp):
+    """Parse "depth" or "depth,temp" into a (depth, temp) tuple. Returns None if invalid"""
+    try:
+        line = line.decode('UTF-8')
+    except AttributeError:
+        pass
+    except UnicodeDecodeError:
+        # Line noise, e.g. when a serial port opens
+        return None
+    fields = line.replace(';', ',').strip().split(',')
+    try:
+        depth = float(fields[0])
+        temp = float(fields[1]) if len(fields) > 1 and fields[1].strip() else default_temp
+    except ValueError:
+        return None
+    return depth, temp
+
+
+def set_depth(url, depth, temp, session=None):
     payload = dict(depth=depth, temp=temp)
-    r = requests.put(url, json=payload, timeout=10)
+    try:
+        r = (session or requests).put(url, json=payload, timeout=10)
+    except requests.exceptions.RequestException as err:
+        log.error("Error setting depth: {}".format(err))
+        return False
     if r.status_code != 200:
         log.error("Error setting depth: {} {}".format(r.status_code, r.text))
+        return False
+    return True
+
+
+def read_source(conn, latest, default_temp):
+    try:
+        for line in conn.iter():
+            value = parse_line(line, default_temp)
+            if value is None:
+                log.warning("Ignoring invalid depth line: {!r}".format(line))
+                continue
+            latest.put(value)
+    finally:
+        latest.close()
+
+
+class StreamStats(object):
+    """Count sent depths and their latency since the last report"""
+    def __init__(self, latest):
+        self.latest = latest
+        self.reset()
+
+    def reset(self):
+        self.sent = 0
+        self.failed = 0
+        self.latencies = []
+        self.latest.coalesced = 0
+
+    def report(self, interval):
+        if self.latencies:
+            log.info("Sent %d depths (%d failed, %d coalesced). Latency mean %.1f ms max %.1f ms",
+                     self.sent, self.failed, self.latest.coalesced,
+                     1000 * sum(self.latencies) / len(self.latencies), 1000 * max(self.latencies))
+        else:
+            log.info("No depth sent in the last %.0f seconds (%d failed)", interval, self.failed)
+        self.reset()
+
+
+def stream(url, conn, rate, default_temp, report_interval=10.0):
+    """
+    Send the latest depth from conn to url at most rate times per second over a persistent
+    HTTP connection. A reading is sent as soon as it arrives unless the previous one was sent
+    less than 1/rate seconds ago, in which case readings arriving meanwhile are coalesced into
+    the newest one. Latency (from line received to request completed) is logged every
+    report_interval seconds and when the source ends.
+    """
+    latest = LatestValue()
+    reader = threading.Thread(target=read_source, args=(conn, latest, default_temp))
+    reader.daemon = True
+    reader.start()
+
+    session = requests.Session()
+    stats = StreamStats(latest)
+    period = 1.0 / rate
+    earliest_send = time.monotonic()
+    last_report = earliest_send
+
+    while True:
+        now = time.monotonic()
+        if now < earliest_send:
+            time.sleep(earliest_send - now)
+
+        timeout = max(0.0, last_report + report_interval - time.monotonic())
+        value, received = latest.take(timeout)
+        if value is not None:
+            earliest_send = time.monotonic() + period
+            if set_depth(url, value[0], value[1], session):
+                stats.sent += 1
+                stats.latencies.append(time.monotonic() - received)
+            else:
+                stats.failed += 1
+        elif latest.closed:
+            break
+
+        now = time.monotonic()
+        if now >= last_report + report_interval:
+            stats.report(now - last_report)
+            last_report = now
+
+    log.info("Depth source ended")
+    stats.report(time.monotonic() - last_report)
 
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('-u', '--url', help='Base URL to use', type=str, default='http://demo.waterlinked.com')
     parser.add_argument('-d', '--depth', help='Depth to send', type=float, default=0.5)
-    parser.add_argument('-t', '--temp', help='Temperature to send', type=float, default=10)
-    parser.add_argument('-r', '--repeat', help='Repeat sending with a delay of the given number of seconds', type=int, default=0)
+    parser.add_argument('-t', '--temp', help='Temperature to send. Also used for streamed lines without temperature', type=float, default=10)
+    parser.add_argument('-r', '--repeat', help='Repeat sending with a delay of the given number of seconds (fractions allowed)', type=float, default=0)
+    # Streaming options
+    parser.add_argument('--stdin', help='Stream depth lines from stdin', action='store_true')
+    parser.add_argument('-i', '--ip', help="Stream depth lines from UDP by specifying interface to listen on. Typically '0.0.0.0'. Default disabled", type=str, default='')
+    parser.add_argument('-p', '--port', help="Port to listen for UDP packets", type=int, default=10111)
+    parser.add_argument('-s', '--serial', help="Stream depth lines from serial port. Example: '/dev/ttyUSB0' or 'COM1'. Default disabled", type=str, default='')
+    parser.add_argument('-b', '--baud', help="Serial port baud rate", type=int, default=9600)
+    parser.add_argument('--rate', help='Maximum rate (Hz) to send streamed depth at', type=float, default=10)
 
+    ugps_profile.add_arguments(parser)
     args = parser.parse_args()
+    ugps_profile.start(args)
 
     baseurl = args.url
+    url = '{}/api/v1/external/depth'.format(baseurl)
+
+    if len([source for source in (args.stdin, args.ip, args.serial) if source]) > 1:
+        parser.print_help()
+        print("ERROR: Please specify only one of --stdin, --ip or --serial")
+        sys.exit(1)
+
+    conn = None
+    try:
+        if args.stdin:
+            log.info("Streaming depth from stdin")
+            conn = StdinReader()
+        elif args.ip:
+            log.info("Streaming depth from UDP port %d on interface %s", args.port, args.ip)
+            conn = UDPReader(args.ip, args.port)
+        elif args.serial:
+            log.info("Streaming depth from serial %s at %d baud", args.serial, args.baud)
+            conn = SerialReader(args.serial, args.baud)
+    except SetupException:
+        print("Aborting")
+        sys.exit(1)
+
+    if conn:
+        if args.rate <= 0:
+            print("ERROR: --rate must be positive")
+            sys.exit(1)
+        log.info("Using baseurl: %s rate: %.1f Hz", baseurl, args.rate)
+        stream(url, conn, args.rate, args.temp)
+        return
+
     log.info("Using baseurl: %s depth: %f temperature %f", args.url, args.depth, args.temp)
 
     while True:
         log.info('Sending depth')
-        set_depth('{}/api/v1/external/depth'.format(baseurl), args.depth, args.temp)
+        set_depth(url, args.depth, args.temp)
 
-        if args.repeat < 1:
+        if args.repeat <= 0:
             break
 
-        log.info('Waiting %d seconds', args.repeat)
+        log.info('Waiting %g seconds', args.repeat)
         time.sleep(args.repeat)
 
 
@@ -10,43 +10,107 @@ Push external GNSS data to Water Linked Underwater GPS
 "orientation": 42,
 "sog": 0.5
 
+Instead of fixed values a recorded NMEA log can be replayed with --replay. GGA, RMC and HDT
+sentences are used, and each GGA sentence results in one update sent to the kit.
 '''
 import requests
 import argparse
+import sys
 import time
 import logging
+import ugps_profile
 
 log = logging.getLogger()
 logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
 
 
-def set_master(url, cog, fix_quality, hdop, lat, long,
-                numsats, orientation, sog):
+def set_master(url, cog, fix_quality, hdop, lat, lon,
+                numsats, orientation, sog, session=None):
   payload = dict(cog = cog, fix_quality = fix_quality, hdop = hdop,
-                  lat = lat, long = long, numsats = numsats,
+                  lat = lat, lon = lon, numsats = numsats,
                   orientation = orientation,
                   sog = sog)
 
-  r = requests.put(url, json=payload, timeout=10)
+  try:
+    r = (session or requests).put(url, json=payload, timeout=10)
+  except requests.exceptions.RequestException as err:
+    log.error("Error setting gps data: {}".format(err))
+    return False
   if r.status_code != 200:
     log.error("Error setting gps data: {} {}".format(r.status_code, r.text))
+    return False
+  return True
+
+
+def _float(value, default):
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return default
+
+
+def replay(url, filename, speed, args):
+  from nmeainput import ReplayReader, SendStats, SetupException
+  import pynmea2
+
+  try:
+    conn = ReplayReader(filename, speed)
+  except SetupException:
+    print("Aborting")
+    sys.exit(1)
+
+  state = dict(cog=args.cog, fix_quality=args.fix_quality, hdop=args.hdop,
+               lat=args.lat, lon=args.lon, numsats=args.numsats,
+               orientation=args.orientation, sog=args.sog)
+  reader = pynmea2.NMEAStreamReader()
+  session = requests.Session()
+  stats = SendStats()
+
+  for data in conn.iter():
+    # Sentences are parsed while iterating, so parse errors are raised inside the loop
+    try:
+      for msg in reader.next(data):
+        if isinstance(msg, pynmea2.types.talker.RMC):
+          state["cog"] = _float(msg.true_course, state["cog"])
+          # Speed over ground as recorded, in knots
+          state["sog"] = _float(msg.spd_over_grnd, state["sog"])
+
+        elif isinstance(msg, pynmea2.types.talker.HDT):
+          state["orientation"] = _float(msg.heading, state["orientation"])
+
+        elif isinstance(msg, pynmea2.types.talker.GGA):
+          state["lat"] = _float(msg.latitude, state["lat"])
+          state["lon"] = _float(msg.longitude, state["lon"])
+          state["fix_quality"] = _float(msg.gps_qual, state["fix_quality"])
+          state["numsats"] = _float(msg.num_sats, state["numsats"])
+          state["hdop"] = _float(msg.horizontal_dil, state["hdop"])
+
+          before = time.monotonic()
+          ok = set_master(url, session=session, **state)
+          stats.add(ok, time.monotonic() - before)
+    except pynmea2.ParseError as e:
+      log.warning("Error while parsing NMEA string: {}".format(e))
+
+  stats.report()
+
 
 # demo.waterlinked.com
 def main():
 
-  parser = argparse.ArgumentParser(description=__doc__)
+  parser = argparse.ArgumentParser(description=__doc__,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
   parser.add_argument('-u', '--url', help='Base URL to use', type=str,\
                       default='http://192.168.7.1')
   parser.add_argument('-c', '--cog', help='cog to send', type=float,\
                       default=42)
   parser.add_argument('-f', '--fix_quality', help='fix_quality to send',\
                       type=float, default=1)
-  parser.add_argument('-h', '--hdop', help='hdop to send',\
+  parser.add_argument('-d', '--hdop', help='hdop to send',\
                       type=float, default=1.9)
   parser.add_argument('-l', '--lat', help='latitude to send',\
                       type=float, default=10)
-  parser.add_argument('-g', '--long', help='longitude to send',\
-                      type=float, default=10)
+  parser.add_argument('-g', '--lon', '--long', dest='lon',\
+                      help='longitude to send', type=float, default=10)
   parser.add_argument('-n', '--numsats', help='numsats to send',\
                       type=float, default=11)
   parser.add_argument('-o', '--orientation', help='orientation to send',\
@@ -57,19 +121,34 @@ def main():
   parser.add_argument('-r', '--repeat', help='Repeat sending with a delay of\
                       the given number of seconds', type=int, default=1)
 
+  parser.add_argument('--replay', help='Replay a recorded NMEA log file\
+                      instead of sending fixed values', type=str, default='')
+  parser.add_argument('--speed', help='Replay speed as a multiple of the\
+                      recorded pace, 0 sends as fast as possible', type=float,\
+                      default=1.0)
+
+  ugps_profile.add_arguments(parser)
   args = parser.parse_args()
+  ugps_profile.start(args)
 
   baseurl = args.url
+  url = '{}/api/v1/external/master'.format(baseurl)
+
+  if args.replay:
+    log.info("Using baseurl: %s replaying: %s at speed %g", args.url,\
+              args.replay, args.speed)
+    replay(url, args.replay, args.speed, args)
+    return
 
-  log.info("Using baseurl: %s depth: %f temperature %f", args.url,\
-            args.depth, args.temp)
+  log.info("Using baseurl: %s lat: %f lon: %f", args.url,\
+            args.lat, args.lon)
 
   while True:
-    log.info('Sending depth')
+    log.info('Sending gps data')
 
-    set_master('{}/api/v1/external/master'.format(baseurl),
+    set_master(url,
                 args.cog, args.fix_quality, args.hdop, args.lat,
-                args.long,
+                args.lon,
                 args.numsats, args.orientation, args.sog)
 
     if args.repeat < 1:
@@ -80,4 +159,4 @@ def main():
 
 
 if __name__ == "__main__":
-  main()  
+  main()
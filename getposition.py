@@ -3,29 +3,58 @@ Get position from Water Linked Underwater GPS
 """
 import argparse
 import json
+import sys
 import requests
+import ugps_profile
 
-def get_data(url):
+def get_data(url, timeout = None):
     try:
-        r = requests.get(url)
+        r = requests.get(url, timeout = timeout)
     except requests.exceptions.RequestException as exc:
-        print("Exception occured {}".format(exc))
+        print("Exception occured {}".format(exc), file = sys.stderr)
         return None
 
     if r.status_code != requests.codes.ok:
-        print("Got error {}: {}".format(r.status_code, r.text))
+        print("Got error {}: {}".format(r.status_code, r.text), file = sys.stderr)
         return None
 
     return r.json()
 
-def get_antenna_position(base_url):
-    return get_data("{}/api/v1/config/antenna".format(base_url))
+def get_antenna_position(base_url, timeout = None):
+    return get_data("{}/api/v1/config/antenna".format(base_url), timeout)
 
-def get_acoustic_position(base_url):
-    return get_data("{}/api/v1/position/acoustic/filtered".format(base_url))
+def get_acoustic_position(base_url, timeout = None):
+    return get_data("{}/api/v1/position/acoustic/filtered".format(base_url), timeout)
 
-def get_global_position(base_url, acoustic_depth = None):
-    return get_data("{}/api/v1/position/global".format(base_url))
+def get_global_position(base_url, acoustic_depth = None, timeout = None):
+    return get_data("{}/api/v1/position/global".format(base_url), timeout)
+
+def get_all(base_url, timeout = None):
+    """
+    Get acoustic, global and antenna position with concurrent requests, so the total time is
+    that of the slowest request. Data that could not be fetched is None.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    getters = {
+        "acoustic": get_acoustic_position,
+        "global": lambda url, timeout: get_global_position(url, timeout = timeout),
+        "antenna": get_antenna_position,
+    }
+    with ThreadPoolExecutor(max_workers = len(getters)) as executor:
+        futures = dict(
+            (name, executor.submit(getter, base_url, timeout)) for name, getter in getters.items())
+        result = dict((name, future.result()) for name, future in futures.items())
+
+    acoustic_position = result["acoustic"]
+    antenna_position = result["antenna"]
+    result["relative_to_antenna"] = None
+    if acoustic_position and antenna_position:
+        result["relative_to_antenna"] = {
+            "x": acoustic_position["x"] - antenna_position["x"],
+            "y": acoustic_position["y"] - antenna_position["y"],
+            "z": acoustic_position["z"] - antenna_position["depth"],
+        }
+    return result
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
@@ -44,15 +73,38 @@ def main():
             "position. Default origin is the point at sea level directly " +
             "below/above that which the positions of the receivers/antenna " +
             "are defined with respect to"))
+    parser.add_argument(
+        "-j",
+        "--json",
+        action = "store_true",
+        help = (
+            "Get acoustic, global and antenna position at once and print them as a single " +
+            "JSON object. Exits with status 1 if acoustic or global position is unavailable"))
+    parser.add_argument(
+        "-t",
+        "--timeout",
+        help = "Timeout in seconds for each request. Default: 5",
+        type = float,
+        default = 5)
+    ugps_profile.add_arguments(parser)
     args = parser.parse_args()
+    ugps_profile.start(args)
 
     base_url = args.url
+
+    if args.json:
+        result = get_all(base_url, args.timeout)
+        print(json.dumps(result))
+        if not (result["acoustic"] and result["global"]):
+            sys.exit(1)
+        return
+
     print("Using base_url: %s" % args.url)
 
-    acoustic_position = get_acoustic_position(base_url)
+    acoustic_position = get_acoustic_position(base_url, args.timeout)
     antenna_position = None
     if args.antenna:
-        antenna_position = get_antenna_position(base_url)
+        antenna_position = get_antenna_position(base_url, args.timeout)
     depth = None
     if acoustic_position:
         if antenna_position:
@@ -69,7 +121,7 @@ def main():
                 acoustic_position["z"]))
         depth = acoustic_position["z"]
 
-    global_position = get_global_position(base_url)
+    global_position = get_global_position(base_url, timeout = args.timeout)
     if global_position:
         if depth:
             print("Current global position. Latitude: {}, Longitude: {}, Depth: {}".format(
@@ -1,14 +1,14 @@
 """
-Read NMEA from UDP or serial and send position and orientation to Water Linked Underwater GPS
+Read NMEA from UDP, serial or a recorded log file and send position and orientation to Water Linked Underwater GPS
 """
 import requests
 import argparse
+import datetime
 import time
 import logging
 import sys
-import serial
-import pynmea2
 import socket
+import ugps_profile
 
 
 log = logging.getLogger()
@@ -19,6 +19,8 @@ class SetupException(Exception):
 
 class SerialReader(object):
     def __init__(self, port, baud):
+        # Imported here so UDP and replay work without pyserial installed
+        import serial
         try:
             self.ser = serial.Serial(port, baud, timeout=5.0)
         except serial.SerialException as err:
@@ -50,22 +52,142 @@ class UDPReader(object):
             yield data
         self.sock.close()
 
-def set_position_master(url, latitude, longitude, orientation):
+class ReplayReader(object):
+    """
+    Replay a recorded NMEA log file.
+
+    Each line may be prefixed with a timestamp (UNIX time in seconds or ISO 8601, separated from
+    the sentence by whitespace or a comma). Files without prefixes are timed by the UTC time field
+    of GGA/RMC/ZDA sentences. Sentences are released at the recorded pace divided by speed, or as
+    fast as possible if speed is 0.
+    """
+    def __init__(self, filename, speed=1.0):
+        try:
+            self.f = open(filename, "r")
+        except IOError as err:
+            print("Replay: Could not open {}. Error: {}".format(filename, err))
+            raise SetupException()
+        self.speed = speed
+
+    def iter(self):
+        start = None
+        first = None
+        last = None
+        day_offset = 0
+        prefixed = None
+        for line in self.f:
+            timestamp, sentence, has_prefix = split_timestamp(line)
+            if not sentence:
+                continue
+            # Use one clock for the whole file: the prefix if the first timed line has one
+            if timestamp is not None and prefixed is None:
+                prefixed = has_prefix
+            if timestamp is not None and has_prefix == prefixed and self.speed > 0:
+                timestamp += day_offset
+                # Time of day from the sentences wraps at midnight
+                if not prefixed and last is not None and timestamp < last - 43200:
+                    day_offset += 86400
+                    timestamp += 86400
+                last = timestamp
+                if first is None:
+                    first = timestamp
+                    start = time.monotonic()
+                delay = start + (timestamp - first) / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            yield sentence + "\n"
+        self.f.close()
+
+
+def _parse_time_prefix(prefix):
+    try:
+        return float(prefix)
+    except ValueError:
+        pass
+    prefix = prefix.rstrip("Z")
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S"):
+        try:
+            dt = datetime.datetime.strptime(prefix, fmt)
+        except ValueError:
+            continue
+        return (dt - datetime.datetime(1970, 1, 1)).total_seconds()
+    return None
+
+
+def split_timestamp(line):
+    """
+    Split a recorded line into (timestamp in seconds, NMEA sentence, timestamp is a prefix).
+    The timestamp is None if the line has no usable time.
+    """
+    line = line.strip()
+    start = line.find("$")
+    if start < 0:
+        start = line.find("!")
+    if start < 0:
+        return None, "", False
+    prefix = line[:start].strip().rstrip(",;").strip()
+    sentence = line[start:]
+    if prefix:
+        return _parse_time_prefix(prefix), sentence, True
+
+    fields = sentence.split(",")
+    if len(fields) > 1 and fields[0][-3:] in ("GGA", "RMC", "ZDA") and len(fields[1]) >= 6:
+        try:
+            hms = fields[1]
+            return int(hms[0:2]) * 3600 + int(hms[2:4]) * 60 + float(hms[4:]), sentence, False
+        except ValueError:
+            pass
+    return None, sentence, False
+
+
+class SendStats(object):
+    """Count requests and their latency to report upload throughput"""
+    def __init__(self):
+        self.start = time.monotonic()
+        self.sent = 0
+        self.failed = 0
+        self.latencies = []
+
+    def add(self, ok, latency):
+        if ok:
+            self.sent += 1
+            self.latencies.append(latency)
+        else:
+            self.failed += 1
+
+    def report(self):
+        elapsed = time.monotonic() - self.start
+        log.info("Sent %d updates (%d failed) in %.1f s: %.1f updates/s",
+                 self.sent, self.failed, elapsed, self.sent / elapsed if elapsed > 0 else 0)
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            log.info("Latency mean %.1f ms median %.1f ms max %.1f ms",
+                     1000 * sum(latencies) / len(latencies),
+                     1000 * latencies[len(latencies) // 2],
+                     1000 * latencies[-1])
+
+
+def set_position_master(url, latitude, longitude, orientation, session=None):
     payload = dict(lat=latitude, lon=longitude, orientation=orientation)
     #Keep loop running even if for some reason there is no connection.
     try:
-        requests.put(url, json=payload, timeout=1)
+        r = (session or requests).put(url, json=payload, timeout=1)
     except  requests.exceptions.RequestException as err:
-        print("Serial connection error: {}".format(err))
+        print("Error sending position: {}".format(err))
+        return False
+    return r.status_code == 200
 
 
 def run(base_url, conn, compass_src):
+    import pynmea2
     lat = 0
     lon = 0
     orientation = 0
     gotUpdate = False
 
     reader = pynmea2.NMEAStreamReader()
+    session = requests.Session()
+    stats = SendStats()
 
     for data in conn.iter():
         #In case the format is given in bytes
@@ -97,9 +219,14 @@ def run(base_url, conn, compass_src):
 
         if gotUpdate:
             log.info('Sending position {} {} and orientation: {}'.format(lat, lon, orientation))
-            set_position_master('{}/api/v1/external/master'.format(base_url), lat, lon, orientation)
+            before = time.monotonic()
+            ok = set_position_master('{}/api/v1/external/master'.format(base_url), lat, lon, orientation, session)
+            stats.add(ok, time.monotonic() - before)
             gotUpdate = False
 
+    # Only reached when the source ends, e.g. at the end of a replayed file
+    stats.report()
+
 def main():
     valid_compass = ["hdt", "hdg", "hdm", "any"]
     valid_compass_str = ', '.join(valid_compass)
@@ -113,19 +240,18 @@ def main():
     # Serial options
     parser.add_argument('-s', '--serial', help="Enable Serial by specifying serial port to use. Example: '/dev/ttyUSB0' or 'COM1' Default disabled", type=str, default='')
     parser.add_argument('-b', '--baud', help="Serial port baud rate", type=int, default=9600)
+    # Replay options
+    parser.add_argument('-f', '--file', help="Enable replay by specifying a recorded NMEA log file. Default disabled", type=str, default='')
+    parser.add_argument('--speed', help="Replay speed as a multiple of the recorded pace, 0 sends as fast as possible. Default: 1", type=float, default=1.0)
+    ugps_profile.add_arguments(parser)
     args = parser.parse_args()
+    ugps_profile.start(args)
 
-    if not (args.ip or args.serial):
-        parser.print_help()
-        print("")
-        print("ERROR: Please specify either serial port or UDP port to use")
-        print("")
-        sys.exit(1)
-
-    if (args.ip and args.serial):
+    sources = [source for source in (args.ip, args.serial, args.file) if source]
+    if len(sources) != 1:
         parser.print_help()
         print("")
-        print("ERROR: Please specify either serial port or UDP port to use")
+        print("ERROR: Please specify either serial port, UDP port or replay file to use")
         print("")
         sys.exit(1)
 
@@ -160,5 +286,16 @@ def main():
         run(args.url, reader, args.compass)
         return
 
+    if args.file:
+        print("Source replay file {} at speed {}".format(args.file, args.speed))
+        try:
+            reader = ReplayReader(args.file, args.speed)
+        except SetupException:
+            print("Aborting")
+            sys.exit(1)
+
+        run(args.url, reader, args.compass)
+        return
+
 if __name__ == "__main__":
     main()
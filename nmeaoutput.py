@@ -3,16 +3,16 @@ Read position from Water Linked Underwater GPS, convert to an NMEA sentence,
 and send to either a serial port, a UDP socket, or a virtual port
 """
 import argparse
+import collections
 import datetime
-import json
 import math
 import os
 import requests
-import signal
 import socket
-import subprocess
 import sys
+import threading
 import time
+import ugps_profile
 
 def get_data(url, stderr=False):
     try:
@@ -88,11 +88,94 @@ def send_udp(sock, ip, port, message):
     sock.sendto(message.encode(), (ip, port))
 
 
+class SerialWriter(object):
+    """
+    Write sentences to a serial port from a background thread so a slow link never stalls polling.
+
+    At most maxlen sentences are queued. When the queue is full the oldest sentence is dropped,
+    since a fresh position is worth more than a stale one. The rate of queued bytes is compared
+    to what the baud rate can carry (10 bits per byte for 8N1) and a warning is printed when the
+    link is over budget. If writing fails (e.g. the adapter is unplugged) the writer stops and
+    the error is raised from the next call to write.
+    """
+    def __init__(self, ser, baud, maxlen=10, window=5.0):
+        self.ser = ser
+        self.maxlen = maxlen
+        self.window = window
+        self.capacity = baud / 10.0
+        self.queue = collections.deque()
+        self.cond = threading.Condition()
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.error = None
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def write(self, sentence):
+        if not isinstance(sentence, bytes):
+            sentence = sentence.encode("utf-8")
+        with self.cond:
+            if self.error:
+                raise self.error
+            if len(self.queue) >= self.maxlen:
+                self.queue.popleft()
+                self.dropped += 1
+            self.queue.append(sentence)
+            self.queued += 1
+            self.cond.notify()
+        self._check_budget(len(sentence))
+
+    def _check_budget(self, length):
+        self.window_bytes += length
+        elapsed = time.monotonic() - self.window_start
+        if elapsed < self.window:
+            return
+        rate = self.window_bytes / elapsed
+        if rate > self.capacity:
+            print("WARNING: Serial output needs {:.0f} bytes/s but the link only carries {:.0f} bytes/s. {}".format(
+                rate, self.capacity, self.counters_str()))
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+
+    def counters(self):
+        with self.cond:
+            return dict(queued=self.queued, written=self.written, dropped=self.dropped,
+                        failed=self.failed, pending=len(self.queue))
+
+    def counters_str(self):
+        return "Serial sentences queued: {queued} written: {written} dropped: {dropped} failed: {failed} pending: {pending}".format(
+            **self.counters())
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                sentence = self.queue.popleft()
+            try:
+                self.ser.write(sentence)
+            # serial.SerialException is an IOError, catching it here keeps pyserial an optional import
+            except (IOError, OSError) as err:
+                with self.cond:
+                    self.failed += 1
+                    self.error = err
+                print("ERROR: Serial write failed: {}. {}".format(err, self.counters_str()))
+                return
+            with self.cond:
+                self.written += 1
+
+
 class VirtualPort:
     """
     Create a virtual port in the computer. Valid for linux with socat installed.
     """
     def __init__(self, password, origin='/dev/ttyS8', end='/dev/ttyS9'):
+        import subprocess
         self.origin = origin
         self.end=end
         self.p = subprocess.Popen(['/bin/bash', '-c', 'echo %s|sudo -S sudo socat PTY,link=%s PTY,link=%s' % (password, self.origin, self.end)], preexec_fn=os.setpgrp)
@@ -102,10 +185,12 @@ class VirtualPort:
         return
 
     def stop(self):
+        import signal
         os.killpg(self.p.pid, signal.SIGTERM)
         return
 
     def write(self, message):
+        import subprocess
         message = "echo \"" + message + "\" > " + self.origin
         subprocess.call(["/bin/bash", "-c", message])
         return
@@ -125,7 +210,9 @@ def main():
     parser.add_argument('-w', '--password', help='Password to execute sudo commands', type=str, default='')
     parser.add_argument('-o', '--origin', help='Virtual port to write to', type=str, default='/dev/ttyS7')
     parser.add_argument('-e', '--end', help='Virtual port to read from', type=str, default='/dev/ttyS9')
+    ugps_profile.add_arguments(parser)
     args = parser.parse_args()
+    ugps_profile.start(args)
 
     if not (args.ip or args.serial or args.password):
         parser.print_help()
@@ -138,7 +225,7 @@ def main():
     if args.serial:
         import serial
         print("Serial port: {}".format(args.serial))
-        ser = serial.Serial(args.serial, args.baud)
+        ser = SerialWriter(serial.Serial(args.serial, args.baud), args.baud)
 
     sock = None
     if args.ip:
@@ -150,6 +237,13 @@ def main():
         print("Sending data from virtual port '{}' to '{}'".format(args.origin, args.end))
         virtualPort = VirtualPort(args.password, args.origin, args.end)
 
+    try:
+        poll(args, ser, sock, virtualPort)
+    except KeyboardInterrupt:
+        if ser:
+            print(ser.counters_str())
+
+def poll(args, ser, sock, virtualPort):
     while True:
         if args.master:
             pos = get_master_position(args.url)
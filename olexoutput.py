@@ -1,14 +1,12 @@
 """
 Read position from Water Linked Underwater GPS convert to use in Olex chart plotter
 """
-from nmeaoutput import get_data, checksum, send_udp, get_master_position
-import requests
+from nmeaoutput import get_data, checksum, send_udp, get_master_position, SerialWriter
 import argparse
-import json
 import time
-from math import floor
 import socket
 import sys
+import ugps_profile
 
 
 def get_acoustic_position(base_url):
@@ -99,7 +97,9 @@ def main():
     # Serial port options
     parser.add_argument('-s', '--serial', help="Enable serial port output by specifying port to use. Example: '/dev/ttyUSB0' or 'COM1' Default disabled", type=str, default='')
     parser.add_argument('-b', '--baud', help="Serial port baud rate", type=int, default=9600)
+    ugps_profile.add_arguments(parser)
     args = parser.parse_args()
+    ugps_profile.start(args)
 
     if not (args.ip or args.serial):
         parser.print_help()
@@ -112,7 +112,7 @@ def main():
     if args.serial:
         import serial
         print("Serial port: {}".format(args.serial))
-        ser = serial.Serial(args.serial, args.baud)
+        ser = SerialWriter(serial.Serial(args.serial, args.baud), args.baud)
 
     sock = None
     if args.ip:
@@ -121,14 +121,22 @@ def main():
 
     sender = Sender(ser, sock, args.ip, args.port, args.verbose)
 
+    try:
+        poll(args.url, sender)
+    except KeyboardInterrupt:
+        if ser:
+            print(ser.counters_str())
+
+
+def poll(base_url, sender):
     while True:
-        pos = get_acoustic_position(args.url)
+        pos = get_acoustic_position(base_url)
 
         if pos:
             sentence = gen_ssb(time.gmtime(), pos["x"], pos["y"], pos["z"])
             sender.send(sentence)
 
-        master = get_master_position(args.url)
+        master = get_master_position(base_url)
         if master:
             sentence = gen_sns(time.gmtime(), master["orientation"])
             sender.send(sentence)
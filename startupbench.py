@@ -0,0 +1,109 @@
+"""
+Measure cold-start time of the example scripts by running each with --help in a new
+Python process, which imports everything the script loads at startup without contacting
+a kit. Results can be appended to a CSV history file to track startup time over time.
+"""
+import argparse
+import csv
+import os
+import platform
+import subprocess
+import sys
+import time
+
+SCRIPTS = [
+    "getposition.py",
+    "nmeaoutput.py",
+    "olexoutput.py",
+    "nmeainput.py",
+    "tracklog.py",
+    "externaldepth.py",
+    "externalgps.py",
+]
+
+HISTORY_FIELDS = ["date", "python", "script", "min_ms", "median_ms"]
+
+
+def measure(script, runs):
+    """Return wall clock times in seconds of running script --help runs times"""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.call([sys.executable, script, "--help"],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+        if result != 0:
+            raise RuntimeError("{} exited with status {}".format(script, result))
+    return times
+
+
+def slowest_imports(script, count):
+    """Return the count modules with the largest cumulative import time (microseconds) for script"""
+    output = subprocess.run([sys.executable, "-X", "importtime", script, "--help"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True).stderr
+    imports = []
+    for line in output.splitlines():
+        fields = line.split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        imports.append((int(fields[1]), fields[2].strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def read_history(filepath):
+    """Return the last median per script from a history file"""
+    last = {}
+    if not os.path.exists(filepath):
+        return last
+    with open(filepath) as history_file:
+        for row in csv.DictReader(history_file):
+            last[row["script"]] = float(row["median_ms"])
+    return last
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("scripts", help="Scripts to measure. Default: all entry points", nargs="*")
+    parser.add_argument("-n", "--runs", help="Number of runs per script. Default: 10", type=int, default=10)
+    parser.add_argument("--history", help="Append results to this CSV file and compare with the previous results", type=str, default="")
+    parser.add_argument("--imports", help="Show the given number of slowest imports per script", type=int, default=0)
+    args = parser.parse_args()
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+    scripts = args.scripts or [os.path.join(directory, script) for script in SCRIPTS]
+    previous = read_history(args.history) if args.history else {}
+    date = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime())
+    python = platform.python_version()
+
+    rows = []
+    print("{:<20} {:>10} {:>10} {:>10}".format("script", "min ms", "median ms", "change"))
+    for script in scripts:
+        name = os.path.basename(script)
+        try:
+            times = sorted(measure(script, args.runs))
+        except RuntimeError as err:
+            print("ERROR: {}. Are the requirements installed?".format(err))
+            continue
+        min_ms = 1000 * times[0]
+        median_ms = 1000 * times[len(times) // 2]
+        change = ""
+        if name in previous:
+            change = "{:+.1f}".format(median_ms - previous[name])
+        print("{:<20} {:>10.1f} {:>10.1f} {:>10}".format(name, min_ms, median_ms, change))
+        for microseconds, module in slowest_imports(script, args.imports) if args.imports else []:
+            print("    {:>8.1f} ms {}".format(microseconds / 1000.0, module))
+        rows.append(dict(date=date, python=python, script=name,
+                         min_ms="{:.1f}".format(min_ms), median_ms="{:.1f}".format(median_ms)))
+
+    if args.history and rows:
+        new_file = not os.path.exists(args.history)
+        with open(args.history, "a", newline="") as history_file:
+            writer = csv.DictWriter(history_file, fieldnames=HISTORY_FIELDS)
+            if new_file:
+                writer.writeheader()
+            writer.writerows(rows)
+        print("Results appended to: {}".format(args.history))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,300 @@
+"""
+Process many tracklog files in parallel using all CPU cores.
+
+Commands:
+  stats    Print statistics (points, duration, distance, speed) for each file as CSV
+  convert  Convert each file to GPX, CSV or GeoJSON in the output directory, keeping the
+           subdirectories of input directories
+  merge    Merge all files, in the order given, into one GPX, CSV or GeoJSON file
+
+Inputs can be GPX, CSV (as written by trackprocess.py) or GeoJSON files, or directories
+containing them. Results are streamed as files finish, with only a few files in memory at
+a time, so any number of files can be processed.
+"""
+import argparse
+import collections
+import functools
+import json
+import os
+import sys
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from trackprocess import load_track, format_times, summary
+
+FORMATS = {"gpx": ".gpx", "csv": ".csv", "geojson": ".geojson"}
+# The loaders raise ValueError for malformed input, the rest covers input they do not anticipate
+LOAD_ERRORS = (IOError, ValueError, KeyError, IndexError, TypeError, ElementTree.ParseError)
+
+STATS_FIELDS = ["points", "duration", "distance", "mean_speed", "max_speed"]
+
+
+class GPXWriter(object):
+    """Write tracks to a GPX file one at a time, each track as a <trk> element"""
+    def __init__(self, f):
+        self.f = f
+        self.f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                     '<gpx xmlns="http://www.topografix.com/GPX/1/1" version="1.1" creator="trackbatch.py">\n')
+
+    def write(self, track, name=None):
+        self.f.write("  <trk>\n")
+        if name:
+            self.f.write("    <name>{}</name>\n".format(
+                name.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")))
+        self.f.write("    <trkseg>\n")
+        lines = []
+        for lat, lon, ele, time in zip(track.lat.tolist(), track.lon.tolist(), track.ele.tolist(),
+                                       format_times(track.time)):
+            point = '      <trkpt lat="{!r}" lon="{!r}">'.format(lat, lon)
+            if ele == ele:
+                point += "<ele>{!r}</ele>".format(ele)
+            if time:
+                point += "<time>{}</time>".format(time)
+            lines.append(point + "</trkpt>\n")
+        self.f.writelines(lines)
+        self.f.write("    </trkseg>\n  </trk>\n")
+
+    def close(self):
+        self.f.write("</gpx>\n")
+
+
+class CSVWriter(object):
+    """Write tracks to one CSV file in the format of trackprocess.save_csv"""
+    def __init__(self, f):
+        self.f = f
+        self.f.write("time,latitude,longitude,elevation\n")
+
+    def write(self, track, name=None):
+        np.savetxt(self.f, np.column_stack(track), delimiter=",", fmt=["%.3f", "%.8f", "%.8f", "%.3f"])
+
+    def close(self):
+        pass
+
+
+class GeoJSONWriter(object):
+    """Write tracks to a GeoJSON FeatureCollection, each track as a LineString feature"""
+    def __init__(self, f):
+        self.f = f
+        self.first = True
+        self.f.write('{"type": "FeatureCollection", "features": [\n')
+
+    def write(self, track, name=None):
+        coordinates = [[lon, lat] if ele != ele else [lon, lat, ele]
+                       for lat, lon, ele in zip(track.lat.tolist(), track.lon.tolist(), track.ele.tolist())]
+        properties = {"coordTimes": format_times(track.time)}
+        if name:
+            properties["name"] = name
+        feature = {"type": "Feature",
+                   "geometry": {"type": "LineString", "coordinates": coordinates},
+                   "properties": properties}
+        if not self.first:
+            self.f.write(",\n")
+        self.first = False
+        json.dump(feature, self.f)
+
+    def close(self):
+        self.f.write("\n]}\n")
+
+
+WRITERS = {"gpx": GPXWriter, "csv": CSVWriter, "geojson": GeoJSONWriter}
+
+
+def find_files(paths):
+    """
+    Yield (file path, path relative to the input it was found in) for the track files in paths,
+    expanding directories to the track files they contain
+    """
+    extensions = (".gpx", ".csv", ".geojson")
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path, os.path.basename(path)
+            continue
+        for root, _, filenames in sorted(os.walk(path)):
+            for filename in sorted(filenames):
+                if filename.lower().endswith(extensions):
+                    filepath = os.path.join(root, filename)
+                    yield filepath, os.path.relpath(filepath, path)
+
+
+def bounded_map(executor, fn, items, max_pending):
+    """
+    Like executor.map, but submit at most max_pending items ahead of the result being
+    consumed, so memory use does not grow with the number of items. Results keep input order.
+    """
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def file_stats(filepath):
+    try:
+        return filepath, summary(load_track(filepath)), None
+    except LOAD_ERRORS as err:
+        return filepath, None, str(err)
+
+
+def convert_file(paths, fmt):
+    filepath, output_filepath = paths
+    if os.path.abspath(output_filepath) == os.path.abspath(filepath):
+        return filepath, None, "Output would overwrite input"
+    try:
+        track = load_track(filepath)
+        output_subdir = os.path.dirname(output_filepath)
+        if output_subdir:
+            os.makedirs(output_subdir, exist_ok=True)
+        with open(output_filepath, "w") as output_file:
+            writer = WRITERS[fmt](output_file)
+            writer.write(track, os.path.splitext(os.path.basename(filepath))[0])
+            writer.close()
+    except LOAD_ERRORS as err:
+        return filepath, None, str(err)
+    return filepath, output_filepath, None
+
+
+def load_file(filepath):
+    try:
+        return filepath, load_track(filepath), None
+    except LOAD_ERRORS as err:
+        return filepath, None, str(err)
+
+
+def run_stats(executor, files, max_pending):
+    filepaths = (filepath for filepath, _ in files)
+    print("file," + ",".join(STATS_FIELDS))
+    total = dict(points=0, duration=0.0, distance=0.0, max_speed=0.0)
+    errors = 0
+    for filepath, stats, error in bounded_map(executor, file_stats, filepaths, max_pending):
+        if error:
+            print("ERROR: {}: {}".format(filepath, error), file=sys.stderr)
+            errors += 1
+            continue
+        print("{},{},{:.1f},{:.1f},{:.3f},{:.3f}".format(filepath, *[stats[field] for field in STATS_FIELDS]))
+        total["points"] += stats["points"]
+        total["duration"] += stats["duration"]
+        total["distance"] += stats["distance"]
+        if stats["max_speed"] == stats["max_speed"]:
+            total["max_speed"] = max(total["max_speed"], stats["max_speed"])
+    mean_speed = total["distance"] / total["duration"] if total["duration"] > 0 else float("nan")
+    print("TOTAL,{},{:.1f},{:.1f},{:.3f},{:.3f}".format(
+        total["points"], total["duration"], total["distance"], mean_speed, total["max_speed"]))
+    return errors
+
+
+def output_paths(files, output_dir, fmt, collisions):
+    """
+    Yield (file path, output path) keeping each file's subdirectory below output_dir.
+    Files that would be written to an output path already used are appended to collisions
+    and skipped.
+    """
+    used = {}
+    for filepath, relative in files:
+        output_filepath = os.path.join(output_dir, os.path.splitext(relative)[0] + FORMATS[fmt])
+        key = os.path.normcase(os.path.abspath(output_filepath))
+        if key in used:
+            collisions.append((filepath, used[key], output_filepath))
+            continue
+        used[key] = filepath
+        yield filepath, output_filepath
+
+
+def run_convert(executor, files, max_pending, output_dir, fmt):
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    convert = functools.partial(convert_file, fmt=fmt)
+    collisions = []
+    errors = 0
+    for filepath, output_filepath, error in bounded_map(
+            executor, convert, output_paths(files, output_dir, fmt, collisions), max_pending):
+        if error:
+            print("ERROR: {}: {}".format(filepath, error), file=sys.stderr)
+            errors += 1
+            continue
+        print("{} -> {}".format(filepath, output_filepath))
+    for filepath, other, output_filepath in collisions:
+        print("ERROR: {}: Not converted, {} is already converted to {}".format(filepath, other, output_filepath),
+              file=sys.stderr)
+    return errors + len(collisions)
+
+
+def run_merge(executor, files, max_pending, output_filepath, fmt):
+    # The output may be inside an input directory, never read back what is being written
+    output_key = os.path.normcase(os.path.abspath(output_filepath))
+    filepaths = (filepath for filepath, _ in files
+                 if os.path.normcase(os.path.abspath(filepath)) != output_key)
+    errors = 0
+    points = 0
+    with open(output_filepath, "w") as output_file:
+        writer = WRITERS[fmt](output_file)
+        for filepath, track, error in bounded_map(executor, load_file, filepaths, max_pending):
+            if error:
+                print("ERROR: {}: {}".format(filepath, error), file=sys.stderr)
+                errors += 1
+                continue
+            writer.write(track, os.path.splitext(os.path.basename(filepath))[0])
+            points += len(track.time)
+            print("Merged {} ({} points)".format(filepath, len(track.time)))
+        writer.close()
+    print("Saved {} points to: {}".format(points, output_filepath))
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", help="stats, convert or merge", choices=["stats", "convert", "merge"])
+    parser.add_argument("inputs", help="Track files or directories with track files", nargs="+")
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Output directory for convert, output file for merge",
+        type=str,
+        default="")
+    parser.add_argument(
+        "-f",
+        "--format",
+        help="Output format for convert and merge: gpx, csv or geojson. Default: from --output extension for merge, csv for convert",
+        choices=sorted(FORMATS),
+        default=None)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="Number of worker processes. Default: number of CPU cores",
+        type=int,
+        default=None)
+    args = parser.parse_args()
+
+    if args.command != "stats" and not args.output:
+        parser.print_help()
+        print("ERROR: Please specify --output for {}".format(args.command))
+        sys.exit(1)
+
+    fmt = args.format
+    if not fmt:
+        fmt = "csv"
+        if args.command == "merge":
+            ext = os.path.splitext(args.output)[1].lower()
+            fmt = {".gpx": "gpx", ".geojson": "geojson", ".json": "geojson"}.get(ext, "csv")
+
+    jobs = args.jobs or os.cpu_count() or 1
+    # Keep a couple of files per worker queued so no core idles while results are written
+    max_pending = 2 * jobs
+    files = find_files(args.inputs)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        if args.command == "stats":
+            errors = run_stats(executor, files, max_pending)
+        elif args.command == "convert":
+            errors = run_convert(executor, files, max_pending, args.output, fmt)
+        else:
+            errors = run_merge(executor, files, max_pending, args.output, fmt)
+
+    if errors:
+        print("{} files failed".format(errors), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
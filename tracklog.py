@@ -5,8 +5,11 @@ import requests
 import argparse
 import time
 import datetime
-import gpxpy
-import gpxpy.gpx
+import json
+import os
+import ugps_profile
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
 
 def get_data(url):
     try:
@@ -38,36 +41,190 @@ def _elevation(base_url):
     depth = acoustic_position["z"]
     return -depth
 
-def create_master_tracklog(gpx, base_url):
+# gpxpy is imported where it is used, so reading the index stays fast
+def _new_gpx():
+    import gpxpy.gpx
+    gpx = gpxpy.gpx.GPX()
     gpx_track = gpxpy.gpx.GPXTrack()
     gpx.tracks.append(gpx_track)
 
     gpx_segment = gpxpy.gpx.GPXTrackSegment()
     gpx_track.segments.append(gpx_segment)
+    return gpx, gpx_segment
+
+class FileWriter(object):
+    """Collect all points in memory and save them to a single GPX file when closed"""
+    def __init__(self, output_filepath):
+        self.output_filepath = output_filepath
+        self.gpx, self.segment = _new_gpx()
+
+    def add(self, point):
+        self.segment.points.append(point)
+
+    def close(self):
+        print("Saving data to: {}".format(self.output_filepath))
+        with open(self.output_filepath, "w") as output_file:
+            output_file.write(self.gpx.to_xml())
+
+class ChunkWriter(object):
+    """
+    Save points to a series of GPX files, starting a new file when the current one spans
+    max_seconds or holds max_points points. Each finished file is recorded in an index
+    (see index_filepath) with its time range and bounding box, so queries only need to
+    read the files that overlap.
+    """
+    def __init__(self, output_filepath, max_seconds=None, max_points=None):
+        self.output_filepath = output_filepath
+        self.index_filepath = index_filepath(output_filepath)
+        self.max_seconds = max_seconds
+        self.max_points = max_points
+        self.index = read_index(self.index_filepath) if os.path.exists(self.index_filepath) else []
+        self._start_chunk()
+
+    def _start_chunk(self):
+        self.gpx, self.segment = _new_gpx()
+
+    def _full(self, point):
+        points = self.segment.points
+        if not points:
+            return False
+        if self.max_points and len(points) >= self.max_points:
+            return True
+        if self.max_seconds and (point.time - points[0].time).total_seconds() >= self.max_seconds:
+            return True
+        return False
+
+    def add(self, point):
+        if self._full(point):
+            self.flush()
+        self.segment.points.append(point)
+
+    def flush(self):
+        points = self.segment.points
+        if not points:
+            return
+        stem, ext = os.path.splitext(self.output_filepath)
+        name = "{}-{}".format(stem, points[0].time.strftime("%Y%m%dT%H%M%S"))
+        chunk_filepath = "{}{}".format(name, ext or ".gpx")
+        # Several chunks can start within the same second, never overwrite an earlier one
+        number = 1
+        while os.path.exists(chunk_filepath):
+            number += 1
+            chunk_filepath = "{}-{}{}".format(name, number, ext or ".gpx")
+        print("Saving {} points to: {}".format(len(points), chunk_filepath))
+        with open(chunk_filepath, "w") as output_file:
+            output_file.write(self.gpx.to_xml())
+
+        self.index.append({
+            "file": os.path.basename(chunk_filepath),
+            "start": points[0].time.strftime(TIME_FORMAT),
+            "end": points[-1].time.strftime(TIME_FORMAT),
+            "points": len(points),
+            "min_lat": min(p.latitude for p in points),
+            "max_lat": max(p.latitude for p in points),
+            "min_lon": min(p.longitude for p in points),
+            "max_lon": max(p.longitude for p in points),
+        })
+        write_index(self.index_filepath, self.index)
+        self._start_chunk()
+
+    def close(self):
+        self.flush()
+
+def index_filepath(output_filepath):
+    """Return path of the chunk index belonging to output_filepath, e.g. tracklog.index.json"""
+    return "{}.index.json".format(os.path.splitext(output_filepath)[0])
+
+def read_index(filepath):
+    with open(filepath) as index_file:
+        return json.load(index_file)["chunks"]
+
+def write_index(filepath, chunks):
+    # Write to a temporary file first so an interrupted write never leaves a broken index
+    tmp_filepath = filepath + ".tmp"
+    with open(tmp_filepath, "w") as index_file:
+        json.dump({"chunks": chunks}, index_file, indent=1)
+    os.replace(tmp_filepath, filepath)
+
+def parse_time(value):
+    """Parse a UTC time given as 'YYYY-MM-DDTHH:MM[:SS[.ffffff]]' (a space may replace the T)"""
+    value = value.strip().rstrip("Z").replace(" ", "T")
+    for fmt in (TIME_FORMAT, "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError("Invalid time '{}'. Use YYYY-MM-DDTHH:MM:SS".format(value))
 
+def _utc(timestamp):
+    """Return timestamp as naive UTC datetime, which is how tracklog records time"""
+    if timestamp is not None and timestamp.tzinfo is not None:
+        timestamp = timestamp.replace(tzinfo=None) - timestamp.utcoffset()
+    return timestamp
+
+def find_chunks(chunks, start=None, end=None, bbox=None):
+    """
+    Return index entries overlapping the time window [start, end] and the bounding box
+    bbox=(min_lat, min_lon, max_lat, max_lon). Any limit given as None is not applied.
+    """
+    found = []
+    for chunk in chunks:
+        if start and parse_time(chunk["end"]) < start:
+            continue
+        if end and parse_time(chunk["start"]) > end:
+            continue
+        if bbox:
+            min_lat, min_lon, max_lat, max_lon = bbox
+            if (chunk["max_lat"] < min_lat or chunk["min_lat"] > max_lat or
+                    chunk["max_lon"] < min_lon or chunk["min_lon"] > max_lon):
+                continue
+        found.append(chunk)
+    return found
+
+def query(output_filepath, start=None, end=None, bbox=None):
+    """
+    Yield GPX track points recorded by a ChunkWriter for output_filepath that lie within the
+    time window and bounding box. Only chunk files overlapping the query are read.
+    """
+    import gpxpy
+    directory = os.path.dirname(output_filepath)
+    chunks = read_index(index_filepath(output_filepath))
+    for chunk in find_chunks(chunks, start, end, bbox):
+        with open(os.path.join(directory, chunk["file"])) as chunk_file:
+            gpx = gpxpy.parse(chunk_file)
+        for point, _, _, _ in gpx.walk():
+            timestamp = _utc(point.time)
+            if start and timestamp < start:
+                continue
+            if end and timestamp > end:
+                continue
+            if bbox:
+                min_lat, min_lon, max_lat, max_lon = bbox
+                if not (min_lat <= point.latitude <= max_lat and min_lon <= point.longitude <= max_lon):
+                    continue
+            point.time = timestamp
+            yield point
+
+def create_master_tracklog(writer, base_url):
+    import gpxpy.gpx
     while True:
         position = get_master_position(base_url)
         if not position:
-            log.warning("No master position")
+            print("No master position")
             continue
         latitude = position["lat"]
         longitude = position["lon"]
 
         print("Master: Latitude: {} Longitude: {}".format(latitude, longitude))
-        gpx_segment.points.append(gpxpy.gpx.GPXTrackPoint(
+        writer.add(gpxpy.gpx.GPXTrackPoint(
             latitude,
             longitude,
             time=datetime.datetime.utcnow()))
 
         time.sleep(1)
 
-def create_locator_tracklog(gpx, base_url):
-    gpx_track = gpxpy.gpx.GPXTrack()
-    gpx.tracks.append(gpx_track)
-
-    gpx_segment = gpxpy.gpx.GPXTrackSegment()
-    gpx_track.segments.append(gpx_segment)
-
+def create_locator_tracklog(writer, base_url):
+    import gpxpy.gpx
     while True:
         global_position = get_global_position(base_url)
         if not global_position:
@@ -82,7 +239,7 @@ def create_locator_tracklog(gpx, base_url):
             latitude,
             longitude,
             elevation))
-        gpx_segment.points.append(gpxpy.gpx.GPXTrackPoint(
+        writer.add(gpxpy.gpx.GPXTrackPoint(
             latitude,
             longitude,
             elevation=elevation,
@@ -109,29 +266,43 @@ def main():
         "--master",
         action = "store_true",
         help="Output master GPS track instead of locator GPS track")
+    parser.add_argument(
+        "--rotate-seconds",
+        help=(
+            "Start a new GPX file every given number of seconds. Files are named after " +
+            "the output path and start time, and indexed in <output>.index.json"),
+        type=float,
+        default=None)
+    parser.add_argument(
+        "--rotate-points",
+        help="Start a new GPX file after the given number of points. Can be combined with --rotate-seconds",
+        type=int,
+        default=None)
 
+    ugps_profile.add_arguments(parser)
     args = parser.parse_args()
+    ugps_profile.start(args)
 
     base_url = args.url
     output_filepath = args.output
 
     print(
-        "Creating tracklog for UGPS system at {}. " +
-        "Press Ctrl-C to stop logging".format(base_url, output_filepath))
+        ("Creating tracklog for UGPS system at {}. " +
+        "Press Ctrl-C to stop logging").format(base_url))
 
-    gpx = gpxpy.gpx.GPX()
+    if args.rotate_seconds or args.rotate_points:
+        writer = ChunkWriter(output_filepath, args.rotate_seconds, args.rotate_points)
+    else:
+        writer = FileWriter(output_filepath)
     try:
         if args.master:
-            create_master_tracklog(gpx, base_url)
+            create_master_tracklog(writer, base_url)
         else:
-            create_locator_tracklog(gpx, base_url)
+            create_locator_tracklog(writer, base_url)
     except KeyboardInterrupt:
         pass
 
-    print("Saving data to: {}".format(output_filepath))
-
-    with open(output_filepath, "w") as output_file:
-        output_file.write(gpx.to_xml())
+    writer.close()
 
 if __name__ == "__main__":
     main()
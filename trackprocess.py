@@ -0,0 +1,296 @@
+"""
+Post-process tracks recorded with tracklog.py: reject acoustic jumps, smooth, resample,
+decimate and compute distance, speed and heading. All steps work on NumPy arrays, so
+tracks with millions of points are processed in seconds.
+"""
+import argparse
+import collections
+import json
+import os
+import sys
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+
+EARTH_RADIUS = 6371008.8  # Mean earth radius in meters
+
+# Arrays of equal length. time is seconds since 1970-01-01 UTC, ele is NaN when missing
+Track = collections.namedtuple("Track", ["time", "lat", "lon", "ele"])
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _parse_times(times):
+    """Convert ISO 8601 strings (as written to GPX) to seconds since epoch. Missing times become NaN"""
+    offsets = np.zeros(len(times))
+    cleaned = []
+    for i, value in enumerate(times):
+        if value is None:
+            cleaned.append("NaT")
+            continue
+        value = value.strip()
+        if value.endswith("Z"):
+            value = value[:-1]
+        elif len(value) > 6 and value[-6] in "+-" and value[-3] == ":":
+            sign = 1 if value[-6] == "+" else -1
+            offsets[i] = sign * (int(value[-5:-3]) * 3600 + int(value[-2:]) * 60)
+            value = value[:-6]
+        cleaned.append(value)
+    stamps = np.array(cleaned, dtype="datetime64[us]")
+    seconds = stamps.astype("int64") / 1e6
+    seconds[np.isnat(stamps)] = np.nan
+    return seconds - offsets
+
+
+def load_gpx(filepath):
+    """Load all track points of a GPX file into a Track, in file order"""
+    lat = []
+    lon = []
+    ele = []
+    times = []
+    for _, elem in ElementTree.iterparse(filepath, events=("end",)):
+        if _local_name(elem.tag) != "trkpt":
+            continue
+        if elem.get("lat") is None or elem.get("lon") is None:
+            raise ValueError("Track point {} has no lat/lon".format(len(lat) + 1))
+        lat.append(float(elem.get("lat")))
+        lon.append(float(elem.get("lon")))
+        point_ele = None
+        point_time = None
+        for child in elem:
+            name = _local_name(child.tag)
+            if name == "ele":
+                point_ele = child.text
+            elif name == "time":
+                point_time = child.text
+        ele.append(float(point_ele) if point_ele else np.nan)
+        times.append(point_time)
+        elem.clear()
+    return Track(_parse_times(times), np.array(lat), np.array(lon), np.array(ele))
+
+
+def load_csv(filepath):
+    """Load a track saved by save_csv"""
+    data = np.loadtxt(filepath, delimiter=",", skiprows=1, ndmin=2)
+    if data.size == 0:
+        data = np.empty((0, 4))
+    if data.shape[1] != 4:
+        raise ValueError("Expected 4 columns (time,latitude,longitude,elevation), got {}".format(data.shape[1]))
+    return Track(data[:, 0], data[:, 1], data[:, 2], data[:, 3])
+
+
+def load_geojson(filepath):
+    """
+    Load LineString/MultiLineString features of a GeoJSON file. Coordinates are [lon, lat, ele]
+    and times are read from the "coordTimes" property if present.
+    """
+    with open(filepath) as geojson_file:
+        data = json.load(geojson_file)
+    if not isinstance(data, dict):
+        raise ValueError("Expected a GeoJSON object")
+    features = data.get("features", []) if data.get("type") == "FeatureCollection" else [data]
+    coordinates = []
+    times = []
+    for feature in features:
+        if not isinstance(feature, dict):
+            raise ValueError("Expected GeoJSON features to be objects")
+        geometry = feature.get("geometry") or {}
+        lines = geometry.get("coordinates", [])
+        feature_times = (feature.get("properties") or {}).get("coordTimes")
+        if geometry.get("type") == "LineString":
+            lines = [lines]
+            feature_times = [feature_times] if feature_times else None
+        elif geometry.get("type") != "MultiLineString":
+            continue
+        for i, line in enumerate(lines):
+            for coordinate in line:
+                if not isinstance(coordinate, list) or len(coordinate) < 2:
+                    raise ValueError("Invalid coordinate {!r}, expected [lon, lat] or [lon, lat, ele]".format(coordinate))
+            coordinates.extend(line)
+            line_times = feature_times[i] if feature_times else None
+            times.extend(line_times if line_times else [None] * len(line))
+    return Track(_parse_times(times),
+                 np.array([c[1] for c in coordinates], dtype=float),
+                 np.array([c[0] for c in coordinates], dtype=float),
+                 np.array([c[2] if len(c) > 2 else np.nan for c in coordinates], dtype=float))
+
+
+def load_track(filepath):
+    """Load a GPX, CSV or GeoJSON track depending on the file extension"""
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == ".csv":
+        return load_csv(filepath)
+    if ext in (".geojson", ".json"):
+        return load_geojson(filepath)
+    return load_gpx(filepath)
+
+
+def format_times(seconds):
+    """Convert seconds since epoch to ISO 8601 UTC strings as used in GPX. NaN becomes None"""
+    seconds = np.asarray(seconds, dtype=float)
+    valid = ~np.isnan(seconds)
+    stamps = np.round(np.where(valid, seconds, 0) * 1e6).astype("int64").astype("datetime64[us]")
+    strings = np.datetime_as_string(stamps, unit="ms")
+    return [value + "Z" if ok else None for value, ok in zip(strings.tolist(), valid.tolist())]
+
+
+def save_csv(filepath, track):
+    """Save track as CSV with a header. Time is written as seconds since epoch"""
+    np.savetxt(filepath, np.column_stack(track), delimiter=",", fmt=["%.3f", "%.8f", "%.8f", "%.3f"],
+               header="time,latitude,longitude,elevation", comments="")
+
+
+def select(track, mask):
+    """Return the part of track selected by a boolean mask or index array"""
+    return Track(*(values[mask] for values in track))
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great circle distance in meters between points given in degrees"""
+    lat1, lon1, lat2, lon2 = (np.radians(values) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def distances(track):
+    """Distance in meters from each point to the next (length n - 1)"""
+    return haversine(track.lat[:-1], track.lon[:-1], track.lat[1:], track.lon[1:])
+
+
+def speeds(track):
+    """Speed in m/s between each point and the next (length n - 1). NaN where time does not advance"""
+    dt = np.diff(track.time)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(dt > 0, distances(track) / dt, np.nan)
+
+
+def headings(track):
+    """Initial bearing in degrees (0-360, 0 is north) from each point to the next (length n - 1)"""
+    lat1, lon1, lat2, lon2 = (np.radians(values) for values in
+                              (track.lat[:-1], track.lon[:-1], track.lat[1:], track.lon[1:]))
+    dlon = lon2 - lon1
+    y = np.sin(dlon) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return np.degrees(np.arctan2(y, x)) % 360
+
+
+def reject_outliers(track, max_speed, max_iterations=10):
+    """
+    Remove acoustic jumps: points that can only be reached from both neighbours by moving
+    faster than max_speed (m/s). The first and last point are jumps if they are too fast to
+    reach from a neighbour that itself moves at a normal speed. Segments without a speed
+    (time not advancing) are neither too fast nor normal. Repeated until no more points are
+    removed, since removing a jump can reveal the next one.
+    """
+    for _ in range(max_iterations):
+        if len(track.time) < 3:
+            break
+        track_speeds = speeds(track)
+        # Comparisons with NaN are False, so segments without a speed count as neither
+        too_fast = track_speeds > max_speed
+        normal = track_speeds <= max_speed
+        jump = np.zeros(len(track.time), dtype=bool)
+        jump[1:-1] = too_fast[:-1] & too_fast[1:]
+        jump[0] = too_fast[0] and normal[1]
+        jump[-1] = too_fast[-1] and normal[-2]
+        if not jump.any():
+            break
+        track = select(track, ~jump)
+    return track
+
+
+def _moving_average(values, window):
+    # Running sums over the valid values only, so a missing value does not spread to the rest
+    padded = np.pad(values, (window // 2, window - 1 - window // 2), mode="edge")
+    valid = ~np.isnan(padded)
+    sums = np.cumsum(np.insert(np.where(valid, padded, 0.0), 0, 0.0))
+    counts = np.cumsum(np.insert(valid, 0, False))
+    count = counts[window:] - counts[:-window]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(count > 0, (sums[window:] - sums[:-window]) / count, np.nan)
+
+
+def smooth(track, window):
+    """Smooth position and elevation with a centered moving average over window points"""
+    if window <= 1 or len(track.time) == 0:
+        return track
+    return Track(track.time,
+                 _moving_average(track.lat, window),
+                 _moving_average(track.lon, window),
+                 _moving_average(track.ele, window))
+
+
+def resample(track, rate):
+    """Linearly interpolate track to a fixed rate (Hz) between its first and last point"""
+    valid = ~np.isnan(track.time)
+    track = select(track, valid)
+    if len(track.time) < 2:
+        return track
+    order = np.argsort(track.time, kind="stable")
+    track = select(track, order)
+    time = np.arange(track.time[0], track.time[-1], 1.0 / rate)
+    return Track(time,
+                 np.interp(time, track.time, track.lat),
+                 np.interp(time, track.time, track.lon),
+                 np.interp(time, track.time, track.ele))
+
+
+def decimate(track, factor):
+    """Keep every factor-th point"""
+    return select(track, slice(None, None, factor))
+
+
+def summary(track):
+    """Return dict with number of points, duration (s), distance (m) and mean/max speed (m/s)"""
+    result = dict(points=len(track.time), duration=0.0, distance=0.0, mean_speed=np.nan, max_speed=np.nan)
+    if len(track.time) < 2:
+        return result
+    result["duration"] = float(np.nanmax(track.time) - np.nanmin(track.time))
+    result["distance"] = float(np.sum(distances(track)))
+    if result["duration"] > 0:
+        result["mean_speed"] = result["distance"] / result["duration"]
+    track_speeds = speeds(track)
+    if not np.all(np.isnan(track_speeds)):
+        result["max_speed"] = float(np.nanmax(track_speeds))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("input", help="GPX file to process", type=str)
+    parser.add_argument("-o", "--output", help="Save processed track to this CSV file", type=str, default="")
+    parser.add_argument("--max-speed", help="Reject jumps faster than this speed (m/s)", type=float, default=None)
+    parser.add_argument("--smooth", help="Moving average window in points", type=int, default=1)
+    parser.add_argument("--resample", help="Resample to this rate (Hz)", type=float, default=None)
+    parser.add_argument("--decimate", help="Keep only every given point", type=int, default=1)
+    args = parser.parse_args()
+
+    try:
+        track = load_gpx(args.input)
+    except (IOError, ValueError, ElementTree.ParseError) as err:
+        print("ERROR: Could not load {}: {}".format(args.input, err))
+        sys.exit(1)
+    print("Loaded {} points from {}".format(len(track.time), args.input))
+
+    # Order matters: remove jumps before they are smeared out by smoothing and interpolation
+    if args.max_speed:
+        track = reject_outliers(track, args.max_speed)
+    if args.smooth > 1:
+        track = smooth(track, args.smooth)
+    if args.resample:
+        track = resample(track, args.resample)
+    if args.decimate > 1:
+        track = decimate(track, args.decimate)
+
+    stats = summary(track)
+    print("Points: {points} Duration: {duration:.1f} s Distance: {distance:.1f} m "
+          "Mean speed: {mean_speed:.2f} m/s Max speed: {max_speed:.2f} m/s".format(**stats))
+
+    if args.output:
+        print("Saving data to: {}".format(args.output))
+        save_csv(args.output, track)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Get positions from a rotated tracklog (created with tracklog.py --rotate-seconds/--rotate-points)
+within a time window and/or area. Only the GPX files overlapping the query are read.
+"""
+import argparse
+import os
+import sys
+from tracklog import index_filepath, parse_time, query
+
+def parse_bbox(value):
+    try:
+        bbox = tuple(float(v) for v in value.split(","))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4:
+        raise argparse.ArgumentTypeError("Expected MIN_LAT,MIN_LON,MAX_LAT,MAX_LON")
+    return bbox
+
+def parse_time_arg(value):
+    try:
+        return parse_time(value)
+    except ValueError as err:
+        raise argparse.ArgumentTypeError(str(err))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-i",
+        "--input",
+        help="Output path given to tracklog.py. Default: tracklog.gpx",
+        type=str,
+        default="tracklog.gpx")
+    parser.add_argument(
+        "-s",
+        "--start",
+        help="Start of time window in UTC. Example: 2019-05-03T14:00",
+        type=parse_time_arg)
+    parser.add_argument(
+        "-e",
+        "--end",
+        help="End of time window in UTC. Example: 2019-05-03T14:30",
+        type=parse_time_arg)
+    parser.add_argument(
+        "-b",
+        "--bbox",
+        help="Area as MIN_LAT,MIN_LON,MAX_LAT,MAX_LON",
+        type=parse_bbox)
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Save matching positions to this GPX file instead of printing them",
+        type=str,
+        default="")
+
+    args = parser.parse_args()
+
+    if not os.path.exists(index_filepath(args.input)):
+        print("ERROR: No tracklog index found at {}".format(index_filepath(args.input)))
+        sys.exit(1)
+
+    try:
+        points = query(args.input, args.start, args.end, args.bbox)
+        if not args.output:
+            print("time,latitude,longitude,elevation")
+            for point in points:
+                print("{},{},{},{}".format(
+                    point.time.isoformat(),
+                    point.latitude,
+                    point.longitude,
+                    "" if point.elevation is None else point.elevation))
+            return
+
+        import gpxpy.gpx
+        gpx = gpxpy.gpx.GPX()
+        gpx_track = gpxpy.gpx.GPXTrack()
+        gpx.tracks.append(gpx_track)
+        gpx_segment = gpxpy.gpx.GPXTrackSegment()
+        gpx_track.segments.append(gpx_segment)
+        gpx_segment.points.extend(points)
+    except IOError as err:
+        print("ERROR: {}".format(err))
+        sys.exit(1)
+
+    print("Saving {} points to: {}".format(len(gpx_segment.points), args.output))
+    with open(args.output, "w") as output_file:
+        output_file.write(gpx.to_xml())
+
+if __name__ == "__main__":
+    main()
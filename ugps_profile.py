@@ -0,0 +1,126 @@
+"""
+Profiling support shared by the example scripts, for attaching to field reports.
+
+Call add_arguments(parser) before parsing and start(args) right after. With --profile the
+rest of the run is profiled with cProfile (and tracemalloc with --profile-memory) for
+--profile-seconds seconds or until the script exits, whichever comes first. When the script
+exits the result is saved as <output>.prof (open with pstats or snakeviz) and a readable
+summary <output>.txt.
+
+Only the main thread is profiled.
+"""
+import atexit
+import datetime
+import os
+import sys
+import time
+
+_profiler = None
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group("profiling")
+    group.add_argument("--profile", help="Profile the script and save the result to a file", action="store_true")
+    group.add_argument("--profile-output", help="Base file name for the profile. Default: <script>-<time>", type=str, default="")
+    group.add_argument("--profile-seconds", help="Stop profiling after this many seconds, 0 profiles until exit. Default: 60", type=float, default=60)
+    group.add_argument("--profile-memory", help="Also trace memory allocations (slower)", action="store_true")
+
+
+def _process_age():
+    """Seconds since the process started, or None if not available on this platform"""
+    try:
+        with open("/proc/self/stat") as stat_file:
+            # The command name can contain spaces, fields are counted after its closing parenthesis
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        return uptime - float(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (IOError, OSError, IndexError, ValueError, AttributeError):
+        return None
+
+
+class Profiler(object):
+    def __init__(self, output, memory):
+        import cProfile
+        self.output = output
+        self.memory = memory
+        self.startup = _process_age()
+        self.modules = len(sys.modules)
+        self.started = time.time()
+        self.elapsed = None
+        self.snapshot = None
+        if memory:
+            import tracemalloc
+            tracemalloc.start()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        """
+        Stop collecting. This runs from a signal handler, so it must not write files or print
+        while the interrupted code may be in the middle of doing so.
+        """
+        if self.elapsed is not None:
+            return
+        self.profile.disable()
+        self.elapsed = time.time() - self.started
+        if self.memory:
+            import tracemalloc
+            self.snapshot = tracemalloc.take_snapshot()
+            self.traced = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+    def save(self):
+        self.stop()
+        self.profile.dump_stats(self.output + ".prof")
+        with open(self.output + ".txt", "w") as report:
+            report.write("Command: {}\n".format(" ".join(sys.argv)))
+            report.write("Python: {}\n".format(sys.version.split()[0]))
+            report.write("Started: {} UTC\n".format(
+                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(self.started))))
+            if self.startup is not None:
+                report.write("Startup (interpreter and imports): {:.3f} s\n".format(self.startup))
+            report.write("Modules loaded at startup: {}\n".format(self.modules))
+            report.write("Profiled: {:.1f} s\n\n".format(self.elapsed))
+
+            import pstats
+            stats = pstats.Stats(self.profile, stream=report)
+            stats.sort_stats("cumulative").print_stats(30)
+            stats.sort_stats("tottime").print_stats(30)
+
+            if self.snapshot is not None:
+                current, peak = self.traced
+                report.write("Memory: current {:.1f} KiB, peak {:.1f} KiB\n".format(current / 1024.0, peak / 1024.0))
+                report.write("Top allocations:\n")
+                for stat in self.snapshot.statistics("lineno")[:25]:
+                    report.write("  {}\n".format(stat))
+        # stderr keeps machine readable output on stdout (e.g. getposition.py --json) intact
+        print("Profile saved to: {}.prof and {}.txt".format(self.output, self.output), file=sys.stderr)
+
+
+def _on_alarm(signum, frame):
+    if _profiler:
+        _profiler.stop()
+
+
+def start(args):
+    """Start profiling if --profile was given"""
+    global _profiler
+    if not args.profile or _profiler:
+        return
+    output = args.profile_output
+    if not output:
+        script = os.path.splitext(os.path.basename(sys.argv[0]))[0] or "python"
+        output = "{}-{}".format(script, datetime.datetime.now().strftime("%Y%m%d-%H%M%S"))
+
+    _profiler = Profiler(output, args.profile_memory)
+    atexit.register(_profiler.save)
+
+    # The profile can only be stopped from the thread that started it, a timer signal runs there
+    if args.profile_seconds > 0:
+        import signal
+        if hasattr(signal, "setitimer"):
+            signal.signal(signal.SIGALRM, _on_alarm)
+            signal.setitimer(signal.ITIMER_REAL, args.profile_seconds)
+        else:
+            print("Profiling until exit, --profile-seconds is not supported on this platform", file=sys.stderr)